@@ -1,13 +1,16 @@
 """Define a SimpliSafe account."""
+import asyncio
 import base64
-from datetime import datetime, timedelta
-from json.decoder import JSONDecodeError
+from functools import lru_cache
 import logging
-from typing import Dict, Optional, Type, TypeVar
+import time
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, NoReturn, Optional, Type, TypeVar
 from uuid import uuid4
 
-from aiohttp import ClientSession, ClientTimeout
-from aiohttp.client_exceptions import ClientError
+from aiohttp import ClientSession
+import orjson
+from yarl import URL
 
 from simplipy.errors import (
     EndpointUnavailable,
@@ -18,6 +21,11 @@ from simplipy.errors import (
 from simplipy.system import System
 from simplipy.system.v2 import SystemV2
 from simplipy.system.v3 import SystemV3
+from simplipy.transport import (  # noqa: F401
+    DEFAULT_TIMEOUT,
+    AiohttpBackend,
+    HttpBackend,
+)
 from simplipy.websocket import Websocket
 
 _LOGGER: logging.Logger = logging.getLogger(__name__)
@@ -26,7 +34,8 @@ API_URL_HOSTNAME: str = "api.simplisafe.com"
 API_URL_BASE: str = f"https://{API_URL_HOSTNAME}/v1"
 API_URL_MFA_OOB: str = "http://simplisafe.com/oauth/grant-type/mfa-oob"
 
-DEFAULT_TIMEOUT: int = 10
+DEFAULT_MAX_CONCURRENT_SYSTEM_UPDATES: int = 5
+DEFAULT_TOKEN_EXPIRATION_WINDOW: int = 120
 DEFAULT_USER_AGENT: str = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) AppleWebKit/605.1.15 "
     "(KHTML, like Gecko) Version/13.1.2 Safari/605.1.15"
@@ -37,12 +46,33 @@ DEVICE_ID_TEMPLATE = (
     'WebApp; useragent="Safari 13.1 (SS-ID: {0}) / macOS 10.15.6"; uuid="{1}"; id="{0}"'
 )
 
+REDACTED_PAYLOAD_KEYS = ("access_token", "password", "refresh_token")
+
 SYSTEM_MAP: Dict[int, Type[System]] = {2: SystemV2, 3: SystemV3}
 
+PASSWORD_GRANT_TEMPLATE: Mapping[str, str] = MappingProxyType(
+    {"grant_type": "password", "app_version": "1.62.0", "scope": "offline_access"}
+)
+REFRESH_TOKEN_GRANT_TEMPLATE: Mapping[str, str] = MappingProxyType(
+    {"grant_type": "refresh_token"}
+)
+
 
 ApiType = TypeVar("ApiType", bound="API")
 
 
+def redact_payload(payload: Any) -> Any:
+    """Return a copy of a payload with sensitive values (passwords, etc.) masked."""
+    if not isinstance(payload, dict):
+        return payload
+
+    return {
+        key: "********" if key in REDACTED_PAYLOAD_KEYS else value
+        for key, value in payload.items()
+    }
+
+
+@lru_cache(maxsize=128)
 def generate_device_id(client_id: str) -> str:
     """Generate a random 10-character ID to use as the SimpliSafe device ID."""
     seed = base64.b64encode(client_id.encode()).decode()[:10]
@@ -56,30 +86,80 @@ class API:  # pylint: disable=too-many-instance-attributes
     :meth:`simplipy.API.login_via_credentials` and :meth:`simplipy.API.login_via_token`
     class methods should be used.
 
+    If no ``session`` is provided, the API object creates (and owns) one on first use;
+    in that case, the API object should be closed via :meth:`simplipy.API.async_close`
+    (or used as an async context manager) once it is no longer needed.
+
     :param session: The ``aiohttp`` ``ClientSession`` session used for all HTTP requests
     :type session: ``aiohttp.client.ClientSession``
+    :param http_backend: An alternate HTTP transport (can't be used with ``session``)
+    :type http_backend: :meth:`simplipy.transport.HttpBackend`
     :param client_id: The SimpliSafe client ID to use for this API object
     :type client_id: ``str``
     """
 
+    __slots__ = (
+        "_access_token",
+        "_access_token_expire",
+        "_auth_headers",
+        "_base_headers",
+        "_base_url",
+        "_client_id",
+        "_client_id_string",
+        "_device_id",
+        "_device_id_string",
+        "_http",
+        "_refresh_task",
+        "_refresh_token",
+        "email",
+        "user_id",
+        "websocket",
+    )
+
     def __init__(
-        self, *, client_id: str, session: Optional[ClientSession] = None
+        self,
+        *,
+        client_id: str,
+        session: Optional[ClientSession] = None,
+        http_backend: Optional[HttpBackend] = None,
     ) -> None:
         """Initialize."""
         self._access_token: Optional[str] = None
-        self._access_token_expire: Optional[datetime] = None
-        self._actively_refreshing: bool = False
+        self._auth_headers: Dict[str, str] = {}
+        self._access_token_expire: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
         self._refresh_token: Optional[str] = None
-        self._session: ClientSession = session
+        if session and http_backend:
+            raise ValueError("Only one of session and http_backend may be provided")
+
+        self._http: HttpBackend = http_backend or AiohttpBackend(session)
 
         self._client_id = client_id if client_id else str(uuid4())
         self._client_id_string: str = CLIENT_ID_TEMPLATE.format(self._client_id)
         self._device_id: str = generate_device_id(self._client_id)
+        self._device_id_string: str = DEVICE_ID_TEMPLATE.format(
+            self._device_id, self._client_id
+        )
+
+        self._base_url: URL = URL(API_URL_BASE)
+        self._base_headers: Dict[str, str] = {
+            "Content-Type": "application/json; charset=utf-8",
+            "Host": API_URL_HOSTNAME,
+            "User-Agent": DEFAULT_USER_AGENT,
+        }
 
         self.email: Optional[str] = None
         self.user_id: Optional[int] = None
         self.websocket: Websocket = Websocket()
 
+    async def __aenter__(self: ApiType) -> ApiType:
+        """Enter the async context manager."""
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Exit the async context manager."""
+        await self.async_close()
+
     @property
     def access_token(self) -> Optional[str]:
         """Return the current access token.
@@ -103,6 +183,11 @@ class API:  # pylint: disable=too-many-instance-attributes
         """Return the generated device ID for this API instance."""
         return self._device_id
 
+    @property
+    def device_id_string(self) -> str:
+        """Return the full device ID string sent to SimpliSafe during login."""
+        return self._device_id_string
+
     @property
     def refresh_token(self) -> Optional[str]:
         """Return the current refresh token.
@@ -119,35 +204,45 @@ class API:  # pylint: disable=too-many-instance-attributes
         *,
         client_id: str,
         session: Optional[ClientSession] = None,
+        http_backend: Optional[HttpBackend] = None,
     ) -> ApiType:
         """Create an API object from a email address and password.
 
+        If no ``session`` is provided, the returned API object should be used as an
+        async context manager (``async with api:``) so that its internal session is
+        closed when finished. (If logging in fails, that session is closed before the
+        exception is raised.)
+
         :param email: A SimpliSafe email address
         :type email: ``str``
         :param password: A SimpliSafe password
         :type password: ``str``
         :param session: An ``aiohttp`` ``ClientSession``
         :type session: ``aiohttp.client.ClientSession``
+        :param http_backend: An alternate HTTP transport
+        :type http_backend: :meth:`simplipy.transport.HttpBackend`
         :param client_id: The SimpliSafe client ID to use for this API object
         :type client_id: ``str``
         :rtype: :meth:`simplipy.API`
         """
-        klass = cls(session=session, client_id=client_id)
+        klass = cls(session=session, http_backend=http_backend, client_id=client_id)
         klass.email = email
 
-        await klass.authenticate(
-            {
-                "grant_type": "password",
-                "username": email,
-                "password": password,
-                "client_id": klass.client_id_string,
-                "device_id": DEVICE_ID_TEMPLATE.format(
-                    klass.device_id, klass.client_id
-                ),
-                "app_version": "1.62.0",
-                "scope": "offline_access",
-            }
-        )
+        try:
+            await klass.authenticate(
+                {
+                    **PASSWORD_GRANT_TEMPLATE,
+                    "username": email,
+                    "password": password,
+                    "client_id": klass.client_id_string,
+                    "device_id": klass.device_id_string,
+                }
+            )
+        except BaseException:
+            # The caller never receives the API object, so it can't close any session
+            # it created; do so here:
+            await klass.async_close()
+            raise
 
         return klass
 
@@ -158,78 +253,113 @@ class API:  # pylint: disable=too-many-instance-attributes
         *,
         client_id: str,
         session: Optional[ClientSession] = None,
+        http_backend: Optional[HttpBackend] = None,
     ) -> ApiType:
         """Create an API object from a refresh token.
 
+        If no ``session`` is provided, the returned API object should be used as an
+        async context manager (``async with api:``) so that its internal session is
+        closed when finished. (If logging in fails, that session is closed before the
+        exception is raised.)
+
         :param refresh_token: A SimpliSafe refresh token
         :type refresh_token: ``str``
         :param session: An ``aiohttp`` ``ClientSession``
         :type session: ``aiohttp.client.ClientSession``
+        :param http_backend: An alternate HTTP transport
+        :type http_backend: :meth:`simplipy.transport.HttpBackend`
         :param client_id: The SimpliSafe client ID to use for this API object
         :type client_id: ``str``
         :rtype: :meth:`simplipy.API`
         """
-        klass = cls(session=session, client_id=client_id)
-        await klass.refresh_access_token(refresh_token)
-        return klass
+        klass = cls(session=session, http_backend=http_backend, client_id=client_id)
 
-    async def _get_subscription_data(self) -> dict:
-        """Get the latest location-level data."""
-        subscription_resp: dict = await self.request(
-            "get", f"users/{self.user_id}/subscriptions", params={"activeOnly": "true"}
-        )
+        try:
+            await klass.refresh_access_token(refresh_token)
+        except BaseException:
+            await klass.async_close()
+            raise
 
-        _LOGGER.debug(
-            "users/%s/subscriptions response: %s", self.user_id, subscription_resp
-        )
-
-        return subscription_resp
-
-    async def authenticate(self, payload: dict) -> None:
-        """Authenticate the API object using an authentication payload."""
-        _LOGGER.debug("Authentication payload: %s", payload)
+        return klass
 
-        token_resp: dict = await self.request("post", "api/token", json=payload)
+    def _is_refreshing(self) -> bool:
+        """Return whether the current task is the one refreshing the access token."""
+        return (
+            self._refresh_task is not None
+            and self._refresh_task is asyncio.current_task()
+        )
 
-        if "mfa_token" in token_resp:
-            mfa_challenge_response: dict = await self.request(
+    async def _authenticate_mfa(self, mfa_token: str) -> NoReturn:
+        """Kick off the multi-factor authentication flow (and raise appropriately)."""
+        mfa_challenge_response: dict = (
+            await self.request(
                 "post",
                 "api/mfa/challenge",
                 json={
                     "challenge_type": "oob",
                     "client_id": self._client_id_string,
-                    "mfa_token": token_resp["mfa_token"],
+                    "mfa_token": mfa_token,
                 },
             )
+            or {}
+        )
 
-            await self.request(
-                "post",
-                "api/token",
-                json={
-                    "client_id": self._client_id_string,
-                    "grant_type": API_URL_MFA_OOB,
-                    "mfa_token": token_resp["mfa_token"],
-                    "oob_code": mfa_challenge_response["oob_code"],
-                    "scope": "offline_access",
-                },
-            )
+        await self.request(
+            "post",
+            "api/token",
+            json={
+                "client_id": self._client_id_string,
+                "grant_type": API_URL_MFA_OOB,
+                "mfa_token": mfa_token,
+                "oob_code": mfa_challenge_response["oob_code"],
+                "scope": "offline_access",
+            },
+        )
 
-            raise PendingAuthorizationError(
-                f"Check your email for an MFA link, then use {self._client_id} "
-                "as the client_id parameter in future API calls"
-            )
+        raise PendingAuthorizationError(
+            f"Check your email for an MFA link, then use {self._client_id} "
+            "as the client_id parameter in future API calls"
+        )
+
+    async def _get_subscription_data(self) -> Optional[dict]:
+        """Get the latest location-level data."""
+        # Note that request() already logs the (sizable) response at DEBUG level, so we
+        # don't log it a second time here:
+        return await self.request(
+            "get", f"users/{self.user_id}/subscriptions", params={"activeOnly": "true"}
+        )
+
+    async def authenticate(self, payload: dict) -> None:
+        """Authenticate the API object using an authentication payload."""
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Authentication payload: %s", redact_payload(payload))
+
+        token_resp: dict = await self.request("post", "api/token", json=payload) or {}
+
+        if "mfa_token" in token_resp:
+            await self._authenticate_mfa(token_resp["mfa_token"])
 
         self._access_token = token_resp["access_token"]
-        self._access_token_expire = datetime.now() + timedelta(
-            seconds=int(token_resp["expires_in"]) - 60
+        self._auth_headers = {"Authorization": f"Bearer {self._access_token}"}
+        self._access_token_expire = (
+            time.monotonic()
+            + int(token_resp["expires_in"])
+            - DEFAULT_TOKEN_EXPIRATION_WINDOW
         )
         self._refresh_token = token_resp["refresh_token"]
 
-        auth_check_resp: dict = await self.request("get", "api/authCheck")
-        self.user_id = auth_check_resp["userId"]
+        # The user ID can't change for the lifetime of this object, so we only need to
+        # check it on the initial login (and not on every token refresh):
+        if self.user_id is None:
+            auth_check_resp: dict = await self.request("get", "api/authCheck") or {}
+            self.user_id = auth_check_resp["userId"]
 
         await self.websocket.async_init(self._access_token, self.user_id)
 
+    async def async_close(self) -> None:
+        """Close the underlying HTTP transport (if it was created by this object)."""
+        await self._http.async_close()
+
     async def get_systems(self) -> Dict[str, System]:
         """Get systems associated to the associated SimpliSafe account.
 
@@ -238,114 +368,161 @@ class API:  # pylint: disable=too-many-instance-attributes
 
         :rtype: ``Dict[str, simplipy.system.System]``
         """
-        subscription_resp: dict = await self._get_subscription_data()
+        subscription_resp: Optional[dict] = await self._get_subscription_data()
 
         systems: Dict[str, System] = {}
+        if not subscription_resp:
+            return systems
+
         for system_data in subscription_resp["subscriptions"]:
-            if "version" not in system_data["location"]["system"]:
+            location_info: dict = system_data["location"]
+            version: Optional[int] = location_info["system"].get("version")
+
+            if version is None:
                 _LOGGER.error(
                     "Skipping location with missing system data: %s",
-                    system_data["location"]["sid"],
+                    location_info["sid"],
                 )
                 continue
 
-            version = system_data["location"]["system"]["version"]
-            system_class = SYSTEM_MAP[version]
-            system = system_class(
-                self.request, self._get_subscription_data, system_data["location"]
+            systems[system_data["sid"]] = SYSTEM_MAP[version](
+                self.request, self._get_subscription_data, location_info
             )
-            await system.update(include_system=False)
-            systems[system_data["sid"]] = system
+
+        # Limit the number of simultaneous updates so that accounts with many systems
+        # don't burst past SimpliSafe's rate limits:
+        semaphore = asyncio.Semaphore(DEFAULT_MAX_CONCURRENT_SYSTEM_UPDATES)
+
+        async def update_system(system: System) -> None:
+            """Update a single system."""
+            async with semaphore:
+                await system.update(include_system=False)
+
+        await asyncio.gather(*[update_system(system) for system in systems.values()])
 
         return systems
 
     async def request(  # pylint: disable=too-many-branches
-        self, method: str, endpoint: str, **kwargs
-    ) -> dict:
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        json: Optional[dict] = None,
+        params: Optional[dict] = None,
+    ) -> Optional[dict]:
         """Make an API request."""
-        if (
-            self._access_token_expire
-            and datetime.now() >= self._access_token_expire
-            and not self._actively_refreshing
-        ):
-            _LOGGER.debug(
-                "Need to refresh access token (expiration: %s)",
-                self._access_token_expire,
+        # Serialize JSON payloads here (with orjson) so that every transport receives
+        # ready-to-send bytes:
+        payload = orjson.dumps(json) if json is not None else None
+
+        request_headers = {**self._base_headers, **(headers or {})}
+
+        # A 401 that we can recover from (by refreshing the access token) results in
+        # exactly one retry:
+        retried = False
+
+        while True:
+            if (
+                self._access_token_expire
+                and time.monotonic() >= self._access_token_expire
+                and not self._is_refreshing()
+            ):
+                _LOGGER.debug("Need to refresh access token")
+                await self.refresh_access_token(self._refresh_token)
+
+            request_headers.update(self._auth_headers)
+
+            status, body = await self._http.request(
+                method,
+                self._base_url / endpoint,
+                headers=request_headers,
+                data=payload,
+                params=params,
             )
-            self._actively_refreshing = True
-            await self.refresh_access_token(self._refresh_token)
-
-        kwargs.setdefault("headers", {})
-        if self._access_token:
-            kwargs["headers"]["Authorization"] = f"Bearer {self._access_token}"
-        kwargs["headers"]["Content-Type"] = "application/json; charset=utf-8"
-        kwargs["headers"]["Host"] = API_URL_HOSTNAME
-        kwargs["headers"]["User-Agent"] = DEFAULT_USER_AGENT
-
-        use_running_session = self._session and not self._session.closed
-
-        if use_running_session:
-            session = self._session
-        else:
-            session = ClientSession(timeout=ClientTimeout(total=DEFAULT_TIMEOUT))
-
-        async with session.request(
-            method, f"{API_URL_BASE}/{endpoint}", **kwargs
-        ) as resp:
-            try:
-                data = await resp.json(content_type=None)
-            except JSONDecodeError:
-                message = await resp.text()
-                data = {"error": message}
-
-            _LOGGER.debug("Data received from /%s: %s", endpoint, data)
-
-            try:
-                resp.raise_for_status()
-            except ClientError as err:
-                if data.get("error") == "mfa_required":
-                    return data
-
-                if data.get("type") == "NoRemoteManagement":
-                    raise EndpointUnavailable(
-                        f"Endpoint unavailable in plan: {endpoint}"
-                    ) from None
-
-                if "401" in str(err):
-                    if self._actively_refreshing:
-                        raise InvalidCredentialsError(
-                            "Repeated 401s despite refreshing access token"
-                        ) from None
-                    if self._refresh_token:
-                        _LOGGER.info("401 detected; attempting refresh token")
-                        self._access_token_expire = datetime.now()
-                        return await self.request(method, endpoint, **kwargs)
-                    raise InvalidCredentialsError("Invalid username/password") from None
-
-                if "403" in str(err):
-                    raise InvalidCredentialsError("Invalid username/password") from None
-
-                raise RequestError(
-                    f"There was an error while requesting /{endpoint}: {err}"
-                ) from None
-            finally:
-                if not use_running_session:
-                    await session.close()
-
-        return data
+
+            # Some endpoints respond with an empty body; callers expect None then:
+            if not body.strip():
+                data = None
+            else:
+                try:
+                    data = orjson.loads(body)
+                except orjson.JSONDecodeError:
+                    data = {"error": body.decode("utf-8", "replace")}
+
+            if _LOGGER.isEnabledFor(logging.DEBUG):
+                _LOGGER.debug(
+                    "Data received from /%s: %s", endpoint, redact_payload(data)
+                )
+
+            if status < 400:
+                return data
+
+            if data is None:
+                data = {}
+
+            if data.get("error") == "mfa_required":
+                return data
+
+            if data.get("type") == "NoRemoteManagement":
+                raise EndpointUnavailable(f"Endpoint unavailable in plan: {endpoint}")
+
+            # Access tokens are refreshed before they expire, so this should only
+            # occur if SimpliSafe invalidates a token early:
+            if status == 401:
+                if retried or self._is_refreshing():
+                    raise InvalidCredentialsError(
+                        "Repeated 401s despite refreshing access token"
+                    )
+                if self._refresh_token:
+                    _LOGGER.info("401 detected; attempting refresh token")
+                    self._access_token_expire = time.monotonic()
+                    retried = True
+                    continue
+                raise InvalidCredentialsError("Invalid username/password")
+
+            if status == 403:
+                raise InvalidCredentialsError("Invalid username/password")
+
+            raise RequestError(
+                f"There was an error while requesting /{endpoint}: HTTP {status}"
+            )
+
+    async def _async_refresh_access_token(self, refresh_token: Optional[str]) -> None:
+        """Perform a single access token refresh (run as its own task)."""
+        try:
+            await self.authenticate(
+                {
+                    **REFRESH_TOKEN_GRANT_TEMPLATE,
+                    "client_id": self._client_id,
+                    "refresh_token": refresh_token,
+                }
+            )
+        finally:
+            self._refresh_task = None
+
+    @staticmethod
+    def _on_refresh_done(task: asyncio.Future) -> None:
+        """Retrieve a finished refresh's exception (in case every waiter went away)."""
+        if not task.cancelled():
+            task.exception()
 
     async def refresh_access_token(self, refresh_token: Optional[str]) -> None:
         """Regenerate an access token.
 
+        If a refresh is already in progress, this waits for (and shares the result of)
+        that refresh rather than starting another one; in that case, the provided
+        ``refresh_token`` is ignored.
+
         :param refresh_token: The refresh token to use
         :type refresh_token: str
         """
-        await self.authenticate(
-            {
-                "grant_type": "refresh_token",
-                "client_id": self._client_id,
-                "refresh_token": refresh_token,
-            }
-        )
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(
+                self._async_refresh_access_token(refresh_token)
+            )
+            self._refresh_task.add_done_callback(self._on_refresh_done)
 
-        self._actively_refreshing = False
+        # Shield the shared refresh so that one cancelled caller doesn't cancel it for
+        # everyone else waiting on it:
+        await asyncio.shield(self._refresh_task)
@@ -0,0 +1,200 @@
+"""Define the HTTP transports used to communicate with the SimpliSafe cloud."""
+import asyncio
+from typing import Dict, Optional, Tuple, Union
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from yarl import URL
+
+from simplipy.errors import RequestError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore
+
+DEFAULT_CONNECTION_LIMIT: int = 10
+DEFAULT_DNS_CACHE_TTL: int = 300
+DEFAULT_KEEPALIVE_TIMEOUT: int = 75
+DEFAULT_TIMEOUT: int = 10
+
+
+class HttpBackend:
+    """Define a base HTTP transport.
+
+    A transport is only responsible for moving bytes; JSON handling, authentication,
+    and error handling all happen in :meth:`simplipy.API.request`. Transport-level
+    failures (connection errors, timeouts, etc.) should be raised as
+    :meth:`RequestError <simplipy.errors.RequestError>`.
+    """
+
+    async def async_close(self) -> None:
+        """Release any resources held by the transport."""
+        pass
+
+    async def request(
+        self,
+        method: str,
+        url: Union[str, URL],
+        *,
+        headers: Dict[str, str],
+        data: Optional[bytes] = None,
+        params: Optional[dict] = None,
+    ) -> Tuple[int, bytes]:
+        """Make an HTTP request and return its status code and raw body."""
+        raise NotImplementedError()
+
+
+class AiohttpBackend(HttpBackend):
+    """Define an ``aiohttp``-based HTTP transport (the default).
+
+    If a provided session has been closed, each request falls back to a temporary
+    session.
+
+    :param session: An ``aiohttp`` ``ClientSession`` (created on first use if omitted)
+    :type session: ``aiohttp.client.ClientSession``
+    """
+
+    def __init__(self, session: Optional[ClientSession] = None) -> None:
+        """Initialize."""
+        self._owns_session: bool = session is None
+        self._session: Optional[ClientSession] = session
+
+    async def async_close(self) -> None:
+        """Close the session (if it was created by this transport)."""
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
+
+    async def request(
+        self,
+        method: str,
+        url: Union[str, URL],
+        *,
+        headers: Dict[str, str],
+        data: Optional[bytes] = None,
+        params: Optional[dict] = None,
+    ) -> Tuple[int, bytes]:
+        """Make an HTTP request and return its status code and raw body."""
+        session = self._session
+        if self._owns_session and (session is None or session.closed):
+            session = self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=DEFAULT_CONNECTION_LIMIT,
+                    limit_per_host=DEFAULT_CONNECTION_LIMIT,
+                    keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                    enable_cleanup_closed=True,
+                    ttl_dns_cache=DEFAULT_DNS_CACHE_TTL,
+                ),
+                timeout=ClientTimeout(total=DEFAULT_TIMEOUT),
+            )
+
+        assert session is not None
+
+        if session.closed:
+            # The caller's session has been closed out from under us; rather than
+            # failing, fall back to a temporary session for this request:
+            async with ClientSession(
+                timeout=ClientTimeout(total=DEFAULT_TIMEOUT)
+            ) as temporary_session:
+                return await self._async_request(
+                    temporary_session,
+                    method,
+                    url,
+                    headers=headers,
+                    data=data,
+                    params=params,
+                )
+
+        return await self._async_request(
+            session, method, url, headers=headers, data=data, params=params
+        )
+
+    @staticmethod
+    async def _async_request(
+        session: ClientSession,
+        method: str,
+        url: Union[str, URL],
+        *,
+        headers: Dict[str, str],
+        data: Optional[bytes] = None,
+        params: Optional[dict] = None,
+    ) -> Tuple[int, bytes]:
+        """Make an HTTP request with a particular session."""
+        # Surface transport failures (connection errors, timeouts, etc.) the same way
+        # as every other transport:
+        try:
+            async with session.request(
+                method, url, headers=headers, data=data, params=params
+            ) as resp:
+                return resp.status, await resp.read()
+        except (ClientError, asyncio.TimeoutError) as err:
+            raise RequestError(
+                f"There was an error while requesting {url}: {err}"
+            ) from err
+
+
+class HttpxBackend(HttpBackend):
+    """Define an ``httpx``-based HTTP transport (which can speak HTTP/2).
+
+    This transport requires the optional ``httpx`` dependency (installable via the
+    ``http2`` extra).
+
+    :param http2: Whether HTTP/2 should be negotiated with SimpliSafe
+    :type http2: ``bool``
+    :param client: An ``httpx`` ``AsyncClient`` (created on first use if omitted)
+    :type client: ``httpx.AsyncClient``
+    """
+
+    def __init__(
+        self, *, http2: bool = True, client: Optional["httpx.AsyncClient"] = None
+    ) -> None:
+        """Initialize."""
+        if httpx is None:  # pragma: no cover
+            raise ImportError(
+                "The httpx transport requires the http2 extra: "
+                "pip install simplisafe-python[http2]"
+            )
+
+        self._http2: bool = http2
+        self._owns_client: bool = client is None
+        self._client: Optional["httpx.AsyncClient"] = client
+
+    async def async_close(self) -> None:
+        """Close the client (if it was created by this transport)."""
+        if self._owns_client and self._client and not self._client.is_closed:
+            await self._client.aclose()
+
+    async def request(
+        self,
+        method: str,
+        url: Union[str, URL],
+        *,
+        headers: Dict[str, str],
+        data: Optional[bytes] = None,
+        params: Optional[dict] = None,
+    ) -> Tuple[int, bytes]:
+        """Make an HTTP request and return its status code and raw body."""
+        client = self._client
+        if self._owns_client and (client is None or client.is_closed):
+            client = self._client = httpx.AsyncClient(
+                http2=self._http2,
+                limits=httpx.Limits(
+                    max_connections=DEFAULT_CONNECTION_LIMIT,
+                    keepalive_expiry=DEFAULT_KEEPALIVE_TIMEOUT,
+                ),
+                timeout=DEFAULT_TIMEOUT,
+            )
+
+        assert client is not None
+
+        # Surface transport failures (connection errors, timeouts, etc.) the same way
+        # as every other transport:
+        try:
+            resp = await client.request(
+                method, str(url), headers=headers, content=data, params=params
+            )
+        except httpx.HTTPError as err:
+            raise RequestError(
+                f"There was an error while requesting {url}: {err}"
+            ) from err
+
+        return resp.status_code, resp.content
@@ -64,6 +64,8 @@ async def test_get_events_no_explicit_session(aresponses, v2_server):
 
         assert len(events) == 2
 
+        await simplisafe.async_close()
+
 
 @pytest.mark.asyncio
 async def test_properties(v2_server):
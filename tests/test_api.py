@@ -1,6 +1,11 @@
 """Define tests for the System object."""
 # pylint: disable=protected-access
-from datetime import datetime, timedelta
+import asyncio
+from copy import deepcopy
+import gc
+import json
+import logging
+import time
 
 import aiohttp
 from aresponses import ResponsesMockServer
@@ -13,13 +18,16 @@ from simplipy.errors import (
     RequestError,
 )
 
+from .async_mock import patch
 from .common import (
+    TEST_ACCESS_TOKEN,
     TEST_CLIENT_ID,
     TEST_EMAIL,
     TEST_PASSWORD,
     TEST_REFRESH_TOKEN,
     TEST_SUBSCRIPTION_ID,
     TEST_SYSTEM_ID,
+    TEST_SYSTEM_SERIAL_NO,
     TEST_USER_ID,
     load_fixture,
 )
@@ -203,7 +211,7 @@ async def test_expired_token_refresh(aresponses, v2_server):
                 TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
             )
 
-            simplisafe._access_token_expire = datetime.now() - timedelta(hours=1)
+            simplisafe._access_token_expire = time.monotonic() - 3600
             await simplisafe.request("post", "api/token")
 
 
@@ -240,3 +248,325 @@ async def test_mfa(aresponses):
             await API.login_via_credentials(
                 TEST_EMAIL, TEST_PASSWORD, client_id=None, session=session
             )
+
+
+@pytest.mark.asyncio
+async def test_internal_session(aresponses, v2_server):
+    """Test that an internal session is reused and closed with the API object."""
+    async with v2_server:
+        async with await API.login_via_credentials(
+            TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID
+        ) as simplisafe:
+            session = simplisafe._http._session
+            systems = await simplisafe.get_systems()
+            assert simplisafe._http._session is session
+            assert len(systems) == 1
+            assert not session.closed
+
+        assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_external_session_not_closed(aresponses, v2_server):
+    """Test that a provided session is not closed by the API object."""
+    async with v2_server:
+        async with aiohttp.ClientSession() as session:
+            simplisafe = await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+            )
+            await simplisafe.async_close()
+            assert not session.closed
+
+
+@pytest.mark.asyncio
+async def test_get_multiple_systems(aresponses, v2_subscriptions_response):
+    """Test that every system in an account is created and updated."""
+    subscriptions = json.loads(v2_subscriptions_response)
+    second_subscription = deepcopy(subscriptions["subscriptions"][0])
+    second_subscription["sid"] = 67890
+    second_subscription["location"]["sid"] = 67890
+    subscriptions["subscriptions"].append(second_subscription)
+
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/token",
+        "post",
+        aresponses.Response(text=load_fixture("api_token_response.json"), status=200),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/authCheck",
+        "get",
+        aresponses.Response(text=load_fixture("auth_check_response.json"), status=200),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        f"/v1/users/{TEST_USER_ID}/subscriptions",
+        "get",
+        aresponses.Response(text=json.dumps(subscriptions), status=200),
+    )
+    for subscription_id in (TEST_SUBSCRIPTION_ID, 67890):
+        aresponses.add(
+            "api.simplisafe.com",
+            f"/v1/subscriptions/{subscription_id}/settings",
+            "get",
+            aresponses.Response(
+                text=load_fixture("v2_settings_response.json"), status=200
+            ),
+        )
+
+    async with aiohttp.ClientSession() as session:
+        simplisafe = await API.login_via_credentials(
+            TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+        )
+
+        systems = await simplisafe.get_systems()
+        assert set(systems) == {TEST_SYSTEM_ID, 67890}
+        assert all(
+            system.serial == TEST_SYSTEM_SERIAL_NO for system in systems.values()
+        )
+
+
+@pytest.mark.asyncio
+async def test_expired_token_refresh_concurrent(aresponses, v2_server):
+    """Test that concurrent requests with an expired token share one refresh."""
+    async with v2_server:
+        v2_server.add(
+            "api.simplisafe.com",
+            "/v1/api/token",
+            "post",
+            aresponses.Response(
+                text=load_fixture("api_token_response.json"), status=200
+            ),
+        )
+        v2_server.add(
+            "api.simplisafe.com",
+            "/v1/api/authCheck",
+            "get",
+            aresponses.Response(
+                text=load_fixture("auth_check_response.json"), status=200
+            ),
+        )
+        v2_server.add(
+            "api.simplisafe.com",
+            f"/v1/users/{TEST_USER_ID}/subscriptions",
+            "get",
+            aresponses.Response(
+                text=load_fixture("subscriptions_response.json"), status=200
+            ),
+        )
+
+        async with aiohttp.ClientSession() as session:
+            simplisafe = await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+            )
+
+            simplisafe._access_token_expire = time.monotonic() - 3600
+            await asyncio.gather(
+                simplisafe.request("get", f"users/{TEST_USER_ID}/subscriptions"),
+                simplisafe.request("get", f"users/{TEST_USER_ID}/subscriptions"),
+            )
+            assert simplisafe._access_token_expire > time.monotonic()
+
+
+@pytest.mark.asyncio
+async def test_token_expiration_uses_monotonic_clock(aresponses, v2_server):
+    """Test that the access token expiration is tracked via the monotonic clock."""
+    async with v2_server:
+        async with aiohttp.ClientSession() as session:
+            with patch("simplipy.api.time.monotonic", return_value=1000.0):
+                simplisafe = await API.login_via_credentials(
+                    TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+                )
+
+            assert simplisafe._access_token_expire == 1000.0 + 3600 - 120
+
+
+@pytest.mark.asyncio
+async def test_authentication_payload_redacted(aresponses, caplog, v2_server):
+    """Test that credentials aren't written to the debug log."""
+    caplog.set_level(logging.DEBUG, logger="simplipy.api")
+    # TEST_PASSWORD also appears in IDs, so use something unique to the log check:
+    password = "hunter2-password"
+
+    async with v2_server:
+        async with aiohttp.ClientSession() as session:
+            await API.login_via_credentials(
+                TEST_EMAIL, password, client_id=TEST_CLIENT_ID, session=session
+            )
+
+    assert any("Authentication payload" in e.message for e in caplog.records)
+    assert any("Data received from /api/token" in e.message for e in caplog.records)
+    assert password not in caplog.text
+    assert TEST_REFRESH_TOKEN not in caplog.text
+    assert TEST_ACCESS_TOKEN not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_401_repeated_after_refresh(aresponses):
+    """Test that a 401 after a successful refresh isn't retried again."""
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/token",
+        "post",
+        aresponses.Response(text=load_fixture("api_token_response.json"), status=200),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/authCheck",
+        "get",
+        aresponses.Response(text=load_fixture("auth_check_response.json"), status=200),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        f"/v1/users/{TEST_USER_ID}/subscriptions",
+        "get",
+        aresponses.Response(text="Unauthorized", status=401),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/token",
+        "post",
+        aresponses.Response(text=load_fixture("api_token_response.json"), status=200),
+    )
+    aresponses.add(
+        "api.simplisafe.com",
+        f"/v1/users/{TEST_USER_ID}/subscriptions",
+        "get",
+        aresponses.Response(text="Unauthorized", status=401),
+    )
+
+    async with aiohttp.ClientSession() as session:
+        simplisafe = await API.login_via_credentials(
+            TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+        )
+
+        with pytest.raises(InvalidCredentialsError):
+            await simplisafe.request("get", f"users/{TEST_USER_ID}/subscriptions")
+
+
+@pytest.mark.asyncio
+async def test_empty_response(aresponses, v2_server):
+    """Test that an empty (but successful) response returns None."""
+    async with v2_server:
+        v2_server.add(
+            "api.simplisafe.com",
+            "/v1/api/emptyEndpoint",
+            "delete",
+            aresponses.Response(text="", status=200),
+        )
+
+        async with aiohttp.ClientSession() as session:
+            simplisafe = await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+            )
+
+            assert await simplisafe.request("delete", "api/emptyEndpoint") is None
+
+
+@pytest.mark.asyncio
+async def test_expired_token_refresh_failure_concurrent(aresponses, v2_server):
+    """Test that concurrent requests share (and re-raise) one failed refresh."""
+    async with v2_server:
+        v2_server.add(
+            "api.simplisafe.com",
+            "/v1/api/token",
+            "post",
+            aresponses.Response(text="Unauthorized", status=401),
+        )
+
+        async with aiohttp.ClientSession() as session:
+            simplisafe = await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+            )
+
+            simplisafe._access_token_expire = time.monotonic() - 3600
+            results = await asyncio.gather(
+                *[
+                    simplisafe.request("get", f"users/{TEST_USER_ID}/subscriptions")
+                    for _ in range(3)
+                ],
+                return_exceptions=True,
+            )
+
+            # Only one (failing) token request is mocked; any additional refresh
+            # attempt would hit an unmocked endpoint and raise something else:
+            assert all(
+                isinstance(result, InvalidCredentialsError) for result in results
+            )
+
+
+@pytest.mark.asyncio
+async def test_internal_session_closed_on_failed_login(aresponses):
+    """Test that an internal session is closed when logging in fails."""
+    aresponses.add(
+        "api.simplisafe.com",
+        "/v1/api/token",
+        "post",
+        aresponses.Response(text="Unauthorized", status=403),
+    )
+
+    closed = []
+    original_async_close = API.async_close
+
+    async def async_close(api):
+        """Close the API object and record whether its session ended up closed."""
+        await original_async_close(api)
+        closed.append(api._http._session.closed)
+
+    with patch.object(API, "async_close", async_close):
+        with pytest.raises(InvalidCredentialsError):
+            await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID
+            )
+
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_closed_external_session(aresponses, v2_server):
+    """Test that requests still succeed if a provided session has been closed."""
+    async with v2_server:
+        session = aiohttp.ClientSession()
+        await session.close()
+
+        simplisafe = await API.login_via_credentials(
+            TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+        )
+        assert simplisafe.user_id == TEST_USER_ID
+
+
+@pytest.mark.asyncio
+async def test_expired_token_refresh_failure_all_waiters_cancelled(
+    aresponses, v2_server
+):
+    """Test that a failed refresh doesn't go unretrieved if every waiter is gone."""
+    loop_errors = []
+    asyncio.get_running_loop().set_exception_handler(
+        lambda loop, context: loop_errors.append(context)
+    )
+
+    async def token_handler(request):
+        """Fail the token refresh after a short delay."""
+        await asyncio.sleep(0.05)
+        return aresponses.Response(text="Unauthorized", status=401)
+
+    async with v2_server:
+        v2_server.add("api.simplisafe.com", "/v1/api/token", "post", token_handler)
+
+        async with aiohttp.ClientSession() as session:
+            simplisafe = await API.login_via_credentials(
+                TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, session=session
+            )
+
+            simplisafe._access_token_expire = time.monotonic() - 3600
+            waiter = asyncio.ensure_future(
+                simplisafe.request("get", f"users/{TEST_USER_ID}/subscriptions")
+            )
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+
+            await asyncio.sleep(0.1)
+            gc.collect()
+
+    assert not loop_errors
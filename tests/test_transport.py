@@ -0,0 +1,248 @@
+"""Define tests for the HTTP transports."""
+# pylint: disable=protected-access
+import asyncio
+import json
+
+import aiohttp
+import pytest
+
+from simplipy import API
+from simplipy.errors import InvalidCredentialsError, RequestError
+from simplipy.transport import AiohttpBackend, HttpBackend, HttpxBackend
+
+from .common import TEST_CLIENT_ID, TEST_EMAIL, TEST_PASSWORD, load_fixture
+
+
+class MockBackend(HttpBackend):
+    """Define a transport that replays canned responses."""
+
+    def __init__(self, responses):
+        """Initialize."""
+        self.requests = []
+        self.responses = responses
+
+    async def request(self, method, url, *, headers, data=None, params=None):
+        """Return the canned response for a request."""
+        self.requests.append((method, str(url), headers, data))
+        return self.responses[str(url)]
+
+
+@pytest.mark.asyncio
+async def test_custom_backend():
+    """Test that a custom transport carries all API requests."""
+    backend = MockBackend(
+        {
+            "https://api.simplisafe.com/v1/api/token": (
+                200,
+                load_fixture("api_token_response.json").encode(),
+            ),
+            "https://api.simplisafe.com/v1/api/authCheck": (
+                200,
+                load_fixture("auth_check_response.json").encode(),
+            ),
+        }
+    )
+
+    simplisafe = await API.login_via_credentials(
+        TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, http_backend=backend
+    )
+
+    assert simplisafe.user_id == 12345
+    assert [request[0] for request in backend.requests] == ["post", "get"]
+    assert json.loads(backend.requests[0][3])["username"] == TEST_EMAIL
+    assert backend.requests[1][2]["Authorization"] == "Bearer abcde12345"
+
+
+@pytest.mark.asyncio
+async def test_custom_backend_error():
+    """Test that error statuses from a custom transport are handled."""
+    backend = MockBackend(
+        {"https://api.simplisafe.com/v1/api/token": (403, b"Unauthorized")}
+    )
+
+    with pytest.raises(InvalidCredentialsError):
+        await API.login_via_credentials(
+            TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, http_backend=backend
+        )
+
+
+@pytest.mark.asyncio
+async def test_httpx_backend():
+    """Test that the httpx transport returns statuses and raw bodies."""
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        """Respond to a mocked httpx request."""
+        assert request.headers["Authorization"] == "Bearer abcde12345"
+        assert request.url.params["activeOnly"] == "true"
+        return httpx.Response(200, content=b'{"subscriptions": []}')
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        backend = HttpxBackend(client=client)
+        status, body = await backend.request(
+            "get",
+            "https://api.simplisafe.com/v1/users/12345/subscriptions",
+            headers={"Authorization": "Bearer abcde12345"},
+            params={"activeOnly": "true"},
+        )
+
+        # A provided client is never closed by the transport:
+        await backend.async_close()
+        assert not client.is_closed
+
+    assert status == 200
+    assert body == b'{"subscriptions": []}'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", ["ConnectError", "ReadTimeout"])
+async def test_httpx_backend_transport_error(error):
+    """Test that httpx transport failures are raised as RequestErrors."""
+    httpx = pytest.importorskip("httpx")
+
+    def handler(request):
+        """Fail a mocked httpx request."""
+        raise getattr(httpx, error)("Something went wrong", request=request)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        backend = HttpxBackend(client=client)
+
+        with pytest.raises(RequestError):
+            await backend.request(
+                "get", "https://api.simplisafe.com/v1/api/authCheck", headers={}
+            )
+
+
+@pytest.mark.asyncio
+async def test_httpx_backend_login():
+    """Test logging in end-to-end over the httpx transport."""
+    httpx = pytest.importorskip("httpx")
+    requests = []
+
+    def handler(request):
+        """Respond to a mocked httpx request."""
+        requests.append(request)
+        if request.url.path == "/v1/api/token":
+            return httpx.Response(
+                200, content=load_fixture("api_token_response.json").encode()
+            )
+        if request.url.path == "/v1/api/authCheck":
+            return httpx.Response(
+                200, content=load_fixture("auth_check_response.json").encode()
+            )
+        return httpx.Response(404, content=b"Not Found")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        simplisafe = await API.login_via_credentials(
+            TEST_EMAIL,
+            TEST_PASSWORD,
+            client_id=TEST_CLIENT_ID,
+            http_backend=HttpxBackend(client=client),
+        )
+
+    assert simplisafe.user_id == 12345
+    assert [str(request.url) for request in requests] == [
+        "https://api.simplisafe.com/v1/api/token",
+        "https://api.simplisafe.com/v1/api/authCheck",
+    ]
+    assert json.loads(requests[0].content)["username"] == TEST_EMAIL
+    assert requests[1].headers["Authorization"] == "Bearer abcde12345"
+
+
+def test_default_timeout_reexported():
+    """Test that the default timeout is still importable from simplipy.api."""
+    from simplipy.api import DEFAULT_TIMEOUT  # pylint: disable=import-outside-toplevel
+
+    assert DEFAULT_TIMEOUT == 10
+
+
+@pytest.mark.asyncio
+async def test_aiohttp_backend_connection_error():
+    """Test that aiohttp connection failures are raised as RequestErrors."""
+    async with aiohttp.ClientSession() as session:
+        backend = AiohttpBackend(session)
+
+        with pytest.raises(RequestError):
+            await backend.request("get", "http://127.0.0.1:1/", headers={})
+
+
+@pytest.mark.asyncio
+async def test_aiohttp_backend_timeout(aresponses):
+    """Test that aiohttp timeouts are raised as RequestErrors."""
+
+    async def handler(request):
+        """Respond to a request too slowly."""
+        await asyncio.sleep(1)
+        return aresponses.Response(text="{}", status=200)
+
+    aresponses.add("api.simplisafe.com", "/v1/api/authCheck", "get", handler)
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=0.01)
+    ) as session:
+        backend = AiohttpBackend(session)
+
+        with pytest.raises(RequestError):
+            await backend.request(
+                "get", "https://api.simplisafe.com/v1/api/authCheck", headers={}
+            )
+
+
+@pytest.mark.asyncio
+async def test_request_payload_resent_on_retry():
+    """Test that a JSON payload is sent unchanged when a 401 is retried."""
+    backend = MockBackend(
+        {
+            "https://api.simplisafe.com/v1/api/token": (
+                200,
+                load_fixture("api_token_response.json").encode(),
+            ),
+            "https://api.simplisafe.com/v1/api/authCheck": (
+                200,
+                load_fixture("auth_check_response.json").encode(),
+            ),
+        }
+    )
+    simplisafe = await API.login_via_credentials(
+        TEST_EMAIL, TEST_PASSWORD, client_id=TEST_CLIENT_ID, http_backend=backend
+    )
+
+    statuses = iter([(401, b"Unauthorized"), (200, b'{"state": "off"}')])
+    original_request = backend.request
+
+    async def request(method, url, **kwargs):
+        """Return a 401, then a success, for the state endpoint."""
+        response = await original_request(method, url, **kwargs)
+        if str(url).endswith("/state"):
+            return next(statuses)
+        return response
+
+    backend.responses["https://api.simplisafe.com/v1/state"] = None
+    backend.request = request
+
+    assert await simplisafe.request("post", "state", json={"state": "off"}) == {
+        "state": "off"
+    }
+
+    state_requests = [
+        request for request in backend.requests if request[1].endswith("/state")
+    ]
+    assert len(state_requests) == 2
+    assert all(json.loads(request[3]) == {"state": "off"} for request in state_requests)
+
+
+@pytest.mark.asyncio
+async def test_request_rejects_unknown_arguments():
+    """Test that arguments the transports can't honor are rejected up front."""
+    simplisafe = API(client_id=TEST_CLIENT_ID, http_backend=MockBackend({}))
+
+    with pytest.raises(TypeError):
+        await simplisafe.request("get", "api/authCheck", timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_session_and_backend_exclusive():
+    """Test that providing both a session and a transport is an error."""
+    async with aiohttp.ClientSession() as session:
+        with pytest.raises(ValueError):
+            API(client_id=TEST_CLIENT_ID, session=session, http_backend=MockBackend({}))